@@ -1,10 +1,11 @@
 from asgi_correlation_id.context import celery_current_id, celery_parent_id, correlation_id
-from asgi_correlation_id.log_filters import CeleryTracingIdsFilter, CorrelationIdFilter
+from asgi_correlation_id.log_filters import CeleryTracingIdsFilter, CorrelationIdFilter, CorrelationIdPrefixFilter
 from asgi_correlation_id.middleware import CorrelationIdMiddleware
 
 __all__ = (
     'CeleryTracingIdsFilter',
     'CorrelationIdFilter',
+    'CorrelationIdPrefixFilter',
     'CorrelationIdMiddleware',
     'correlation_id',
     'celery_current_id',
@@ -0,0 +1,92 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from typing import Any, Optional, Protocol, Union
+
+
+class IdCodec(Protocol):
+    """
+    Converts IDs between their canonical form and a compact transport form.
+
+    Canonical IDs are 32-character hex strings, like `uuid4().hex`. Codecs pass
+    any other value through unchanged, in both directions, so peers that send
+    canonical IDs or custom generator values keep working.
+    """
+
+    def encode(self, id_value: str) -> Any: ...  # pragma: no cover
+
+    def decode(self, value: Any) -> str: ...  # pragma: no cover
+
+
+class StringIdCodec(Protocol):
+    """
+    An IdCodec whose transport form is a string.
+
+    Only string codecs can be used where IDs are written as text, like
+    in log records.
+    """
+
+    def encode(self, id_value: str) -> str: ...  # pragma: no cover
+
+    def decode(self, value: str) -> str: ...  # pragma: no cover
+
+
+def _hex_to_bytes(id_value: str) -> Optional[bytes]:
+    if len(id_value) != 32:
+        return None
+    try:
+        return bytes.fromhex(id_value)
+    except ValueError:
+        return None
+
+
+class Base64UrlCodec:
+    """
+    Encode hex IDs as 23-character strings: a `~` marker, followed by
+    22 characters of unpadded base64url.
+
+    The marker is not part of the base64url alphabet, so values from custom
+    generators, which never start with it, can't be mistaken for compact IDs.
+    """
+
+    marker = '~'
+
+    def encode(self, id_value: str) -> str:
+        raw = _hex_to_bytes(id_value)
+        if raw is None:
+            return id_value
+        return self.marker + urlsafe_b64encode(raw)[:22].decode('ascii')
+
+    def decode(self, value: str) -> str:
+        if len(value) != 23 or not value.startswith(self.marker):
+            return value
+        try:
+            raw = urlsafe_b64decode(value[1:] + '==')
+        except (BinasciiError, ValueError):
+            return value
+        if len(raw) != 16:
+            return value
+        id_value = raw.hex()
+        # Only accept the exact form produced by encode
+        return id_value if self.encode(id_value) == value else value
+
+
+class BinaryCodec:
+    """
+    Encode hex IDs as 16 raw bytes.
+
+    Only use this where binary values can be transported, e.g. in Celery
+    message headers with a binary-safe serializer like pickle or msgpack.
+    """
+
+    def encode(self, id_value: str) -> Union[str, bytes]:
+        raw = _hex_to_bytes(id_value)
+        return id_value if raw is None else raw
+
+    def decode(self, value: Union[str, bytes]) -> str:
+        if isinstance(value, bytes) and len(value) == 16:
+            return value.hex()
+        return value.decode('latin-1') if isinstance(value, bytes) else value
+
+
+base64url_codec = Base64UrlCodec()
+binary_codec = BinaryCodec()
@@ -7,3 +7,7 @@ correlation_id: ContextVar[Optional[str]] = ContextVar('correlation_id', default
 # Celery extension
 celery_parent_id: ContextVar[Optional[str]] = ContextVar('celery_parent', default=None)
 celery_current_id: ContextVar[Optional[str]] = ContextVar('celery_current', default=None)
+
+# Asyncio tasks
+asyncio_parent_id: ContextVar[Optional[str]] = ContextVar('asyncio_parent', default=None)
+asyncio_current_id: ContextVar[Optional[str]] = ContextVar('asyncio_current', default=None)
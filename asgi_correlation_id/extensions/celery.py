@@ -1,28 +1,122 @@
-from typing import TYPE_CHECKING, Any, Callable, Dict
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
 from uuid import uuid4
 
 from celery.signals import before_task_publish, task_postrun, task_prerun
 
 from asgi_correlation_id.extensions.sentry import get_sentry_extension
+from asgi_correlation_id.log_filters import render_log_prefixes
 
 if TYPE_CHECKING:
     from celery import Task
+    from celery.utils.dispatch import Signal
+
+    from asgi_correlation_id.codecs import IdCodec
 
 uuid_hex_generator: Callable[[], str] = lambda: uuid4().hex
 
+# Names under which each group of signal receivers is registered
+CORRELATION_ID_HOOKS = 'correlation_id'
+CELERY_TRACING_HOOKS = 'celery_tracing'
+CELERY_METRICS_HOOKS = 'celery_metrics'
+
+# Current receiver of each signal, and the settings they were loaded with, per group
+_registered_hooks: Dict[str, Dict['Signal', Callable[..., None]]] = {}
+_hook_settings: Dict[str, Dict[str, Any]] = {}
+
+
+def _dispatch_uid(name: str, signal: 'Signal') -> str:
+    return f'asgi_correlation_id.{name}.{signal.name}'
+
+
+def _dispatcher(name: str, signal: 'Signal') -> Callable[..., None]:
+    """
+    Return a receiver that calls the current receiver of a group for a signal.
+
+    The dispatcher stays connected while a group is reconfigured, so groups
+    keep their position among the signal's receivers.
+    """
+
+    def dispatch(**kwargs: Any) -> None:
+        receiver = _registered_hooks.get(name, {}).get(signal)
+        if receiver is not None:
+            receiver(**kwargs)
+
+    return dispatch
+
+
+def register_hooks(
+    name: str,
+    hooks: List[Tuple['Signal', Callable[..., None]]],
+    settings: Optional[Dict[str, Any]] = None,
+) -> None:
+    """
+    Connect a group of Celery signal receivers under a single name.
+
+    Calling this again with the same name swaps in the new receivers, rather
+    than stacking up duplicate receivers. The group keeps its position among
+    each signal's receivers, so the order in which groups were first
+    registered is the order in which they run.
+    """
+    previous = _registered_hooks.get(name, {})
+    receivers = dict(hooks)
+    _registered_hooks[name] = receivers
+    _hook_settings[name] = settings or {}
+    for signal in receivers.keys() - previous.keys():
+        signal.connect(_dispatcher(name, signal), weak=False, dispatch_uid=_dispatch_uid(name, signal))
+    for signal in previous.keys() - receivers.keys():
+        signal.disconnect(dispatch_uid=_dispatch_uid(name, signal))
+
+
+def unregister_hooks(name: str) -> None:
+    """
+    Disconnect all Celery signal receivers registered under a name.
+    """
+    _hook_settings.pop(name, None)
+    for signal in _registered_hooks.pop(name, {}):
+        signal.disconnect(dispatch_uid=_dispatch_uid(name, signal))
+
+
+def hooks_registered(name: str) -> bool:
+    """
+    Check whether any Celery signal receivers are registered under a name.
+    """
+    return name in _registered_hooks
+
+
+def hook_settings(name: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the settings the hooks registered under a name were loaded with.
+    """
+    return _hook_settings.get(name)
 
-def load_correlation_ids(header_key: str = 'CORRELATION_ID', generator: Callable[[], str] = uuid_hex_generator) -> None:
+
+def load_correlation_ids(
+    header_key: str = 'CORRELATION_ID',
+    generator: Callable[[], str] = uuid_hex_generator,
+    codec: Optional['IdCodec'] = None,
+    sentry_event_processor: bool = False,
+) -> None:
     """
     Transfer correlation IDs from a HTTP request to a Celery worker,
     when spawned from a request.
 
-    This is called as long as Celery is installed.
+    If a codec is passed, IDs are sent in the codec's compact form, and
+    converted back to their canonical form by the worker.
+
+    If `sentry_event_processor` is True, Sentry events are tagged when
+    captured, rather than tagging the Sentry scope of every task.
+
+    This is called as long as Celery is installed. Calling it again
+    replaces the previously loaded hooks.
     """
     from asgi_correlation_id.context import correlation_id
 
-    sentry_extension = get_sentry_extension()
+    sentry_extension = get_sentry_extension(event_processor=sentry_event_processor)
 
-    @before_task_publish.connect(weak=False)
     def transfer_correlation_id(headers: Dict[str, str], **kwargs: Any) -> None:
         """
         Transfer correlation ID from request thread to Celery worker, by adding
@@ -33,9 +127,8 @@ def load_correlation_ids(header_key: str = 'CORRELATION_ID', generator: Callable
         """
         cid = correlation_id.get()
         if cid:
-            headers[header_key] = cid
+            headers[header_key] = codec.encode(cid) if codec else cid
 
-    @task_prerun.connect(weak=False)
     def load_correlation_id(task: 'Task', **kwargs: Any) -> None:
         """
         Set correlation ID from header if it exists.
@@ -44,14 +137,16 @@ def load_correlation_ids(header_key: str = 'CORRELATION_ID', generator: Callable
         """
         id_value = task.request.get(header_key)
         if id_value:
+            if codec:
+                id_value = codec.decode(id_value)
             correlation_id.set(id_value)
             sentry_extension(id_value)
         else:
             generated_correlation_id = generator()
             correlation_id.set(generated_correlation_id)
             sentry_extension(generated_correlation_id)
+        render_log_prefixes()
 
-    @task_postrun.connect(weak=False)
     def cleanup(**kwargs: Any) -> None:
         """
         Clear context vars, to avoid re-using values in the next task.
@@ -60,22 +155,49 @@ def load_correlation_ids(header_key: str = 'CORRELATION_ID', generator: Callable
         but must be manually reset for workers.
         """
         correlation_id.set(None)
+        render_log_prefixes()
+
+    register_hooks(
+        CORRELATION_ID_HOOKS,
+        [
+            (before_task_publish, transfer_correlation_id),
+            (task_prerun, load_correlation_id),
+            (task_postrun, cleanup),
+        ],
+        settings={
+            'header_key': header_key,
+            'generator': generator,
+            'codec': codec,
+            'sentry_event_processor': sentry_event_processor,
+        },
+    )
+
+
+def unload_correlation_ids() -> None:
+    """
+    Disconnect the hooks connected by `load_correlation_ids`.
+    """
+    unregister_hooks(CORRELATION_ID_HOOKS)
 
 
 def load_celery_current_and_parent_ids(
     header_key: str = 'CELERY_PARENT_ID',
     generator: Callable[[], str] = uuid_hex_generator,
     use_internal_celery_task_id: bool = False,
+    codec: Optional['IdCodec'] = None,
 ) -> None:
     """
     Configure Celery event hooks for generating tracing IDs with depth.
 
+    If a codec is passed, IDs are sent in the codec's compact form, and
+    converted back to their canonical form by the worker.
+
     This is not called automatically by the middleware.
     To use this, users should manually run it during startup.
+    Calling it again replaces the previously loaded hooks.
     """
     from asgi_correlation_id.context import celery_current_id, celery_parent_id
 
-    @before_task_publish.connect(weak=False)
     def publish_task_from_worker_or_request(headers: Dict[str, str], **kwargs: Any) -> None:
         """
         Transfer the current ID to the next Celery worker, by adding
@@ -85,24 +207,252 @@ def load_celery_current_and_parent_ids(
         """
         current = celery_current_id.get()
         if current:
-            headers[header_key] = current
+            headers[header_key] = codec.encode(current) if codec else current
 
-    @task_prerun.connect(weak=False)
     def worker_prerun(task_id: str, task: 'Task', **kwargs: Any) -> None:
         """
         Set current ID, and parent ID if it exists.
         """
         parent_id = task.request.get(header_key)
         if parent_id:
-            celery_parent_id.set(parent_id)
+            celery_parent_id.set(codec.decode(parent_id) if codec else parent_id)
 
         celery_id = task_id if use_internal_celery_task_id else generator()
         celery_current_id.set(celery_id)
+        render_log_prefixes()
 
-    @task_postrun.connect(weak=False)
     def clean_up(**kwargs: Any) -> None:
         """
         Clear context vars, to avoid re-using values in the next task.
         """
         celery_current_id.set(None)
         celery_parent_id.set(None)
+        render_log_prefixes()
+
+    register_hooks(
+        CELERY_TRACING_HOOKS,
+        [
+            (before_task_publish, publish_task_from_worker_or_request),
+            (task_prerun, worker_prerun),
+            (task_postrun, clean_up),
+        ],
+    )
+
+
+def unload_celery_current_and_parent_ids() -> None:
+    """
+    Disconnect the hooks connected by `load_celery_current_and_parent_ids`.
+    """
+    unregister_hooks(CELERY_TRACING_HOOKS)
+
+
+# Task metrics
+
+DEFAULT_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+DEFAULT_RETRY_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+# Start time and correlation ID of the running task, set on prerun
+_task_started: ContextVar[Optional[Tuple[float, Optional[str]]]] = ContextVar('task_started', default=None)
+
+
+class Histogram:
+    """
+    Fixed-size histogram of observed values.
+
+    Each bucket keeps a count, and the correlation ID of the latest observation
+    as an exemplar, so memory use does not grow with the number of observations.
+    The last bucket catches values above the largest bound.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = Lock()
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.exemplars: List[Optional[str]] = [None] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def reset(self) -> None:
+        self.pop()
+
+    def observe(self, value: float, exemplar: Optional[str] = None) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.exemplars[index] = exemplar
+            self.count += 1
+            self.sum += value
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {
+            'buckets': list(zip(self.buckets + (float('inf'),), self.counts, self.exemplars)),
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._snapshot()
+
+    def pop(self) -> Dict[str, Any]:
+        """
+        Return a snapshot and reset the histogram, without losing concurrent observations.
+        """
+        with self._lock:
+            snapshot = self._snapshot()
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.exemplars = [None] * (len(self.buckets) + 1)
+            self.count = 0
+            self.sum = 0.0
+        return snapshot
+
+
+class CeleryTaskMetrics:
+    """
+    In-process histograms of queue wait time, execution time and retries per task.
+    """
+
+    def __init__(
+        self,
+        exporter: Optional[Callable[[Dict[str, Dict[str, Any]]], None]] = None,
+        export_interval: float = 60.0,
+        time_buckets: Sequence[float] = DEFAULT_TIME_BUCKETS,
+        retry_buckets: Sequence[float] = DEFAULT_RETRY_BUCKETS,
+    ):
+        self.exporter = exporter
+        self.export_interval = export_interval
+        self.queue_wait_seconds = Histogram(time_buckets)
+        self.execution_seconds = Histogram(time_buckets)
+        self.retries = Histogram(retry_buckets)
+        self._last_export = time.monotonic()
+        self._export_lock = Lock()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            'queue_wait_seconds': self.queue_wait_seconds.snapshot(),
+            'execution_seconds': self.execution_seconds.snapshot(),
+            'retries': self.retries.snapshot(),
+        }
+
+    def reset(self) -> None:
+        self.queue_wait_seconds.reset()
+        self.execution_seconds.reset()
+        self.retries.reset()
+
+    def pop(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            'queue_wait_seconds': self.queue_wait_seconds.pop(),
+            'execution_seconds': self.execution_seconds.pop(),
+            'retries': self.retries.pop(),
+        }
+
+    def _export(self) -> None:
+        self._last_export = time.monotonic()
+        if self.exporter is not None:
+            self.exporter(self.pop())
+
+    def export(self) -> None:
+        """
+        Pass a snapshot of the histograms to the exporter, and start over.
+        """
+        with self._export_lock:
+            self._export()
+
+    def maybe_export(self) -> None:
+        """
+        Export, if the export interval has passed since the last export.
+
+        Only one of several tasks finishing at the same time exports.
+        """
+        if self.exporter is None or time.monotonic() - self._last_export < self.export_interval:
+            return
+        with self._export_lock:
+            if time.monotonic() - self._last_export >= self.export_interval:
+                self._export()
+
+
+def load_celery_task_metrics(
+    header_key: str = 'CELERY_PUBLISHED_AT',
+    exporter: Optional[Callable[[Dict[str, Dict[str, Any]]], None]] = None,
+    export_interval: float = 60.0,
+    time_buckets: Sequence[float] = DEFAULT_TIME_BUCKETS,
+    retry_buckets: Sequence[float] = DEFAULT_RETRY_BUCKETS,
+    correlation_id_header_key: str = 'CORRELATION_ID',
+    codec: Optional['IdCodec'] = None,
+) -> CeleryTaskMetrics:
+    """
+    Configure Celery event hooks for recording queue wait time, execution time
+    and retry counts of tasks.
+
+    Observations are aggregated in histograms, with the correlation ID of the
+    latest observation in each bucket kept as an exemplar. The correlation ID
+    is read from the task headers set by `load_correlation_ids`, so
+    `correlation_id_header_key` and `codec` should match its arguments. Tasks
+    published without a correlation ID have no exemplar. Retries are recorded
+    once per task, when it stops being retried.
+
+    If an exporter is passed, it is called with a snapshot of the histograms by
+    the worker, at most once per `export_interval` seconds, after which the
+    histograms are reset.
+
+    This is not called automatically by the middleware.
+    To use this, users should manually run it during startup, in both
+    the publishing and the worker processes.
+    """
+    metrics = CeleryTaskMetrics(
+        exporter=exporter,
+        export_interval=export_interval,
+        time_buckets=time_buckets,
+        retry_buckets=retry_buckets,
+    )
+
+    def stamp_publish_time(headers: Dict[str, Any], **kwargs: Any) -> None:
+        """
+        Add the publish timestamp as a header, to measure queue wait time in the worker.
+        """
+        headers[header_key] = time.time()
+
+    def record_queue_wait(task: 'Task', **kwargs: Any) -> None:
+        """
+        Record the time spent in the queue, and start timing the task.
+        """
+        cid = task.request.get(correlation_id_header_key)
+        if cid and codec:
+            cid = codec.decode(cid)
+        published_at = task.request.get(header_key)
+        if published_at is not None:
+            wait = max(time.time() - float(published_at), 0.0)
+            metrics.queue_wait_seconds.observe(wait, cid)
+        _task_started.set((time.perf_counter(), cid))
+
+    def record_execution(task: 'Task', state: Optional[str] = None, **kwargs: Any) -> None:
+        """
+        Record the execution time of the attempt, and the retry count of the
+        task, unless it's about to be retried.
+        """
+        started = _task_started.get()
+        if started is None:
+            return
+        started_at, cid = started
+        _task_started.set(None)
+        metrics.execution_seconds.observe(time.perf_counter() - started_at, cid)
+        if state != 'RETRY':
+            metrics.retries.observe(task.request.retries or 0, cid)
+        metrics.maybe_export()
+
+    register_hooks(
+        CELERY_METRICS_HOOKS,
+        [
+            (before_task_publish, stamp_publish_time),
+            (task_prerun, record_queue_wait),
+            (task_postrun, record_execution),
+        ],
+    )
+    return metrics
+
+
+def unload_celery_task_metrics() -> None:
+    """
+    Disconnect the hooks connected by `load_celery_task_metrics`.
+    """
+    unregister_hooks(CELERY_METRICS_HOOKS)
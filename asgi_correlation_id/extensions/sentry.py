@@ -1,15 +1,24 @@
-from typing import Callable
+from typing import Any, Callable, Dict
 
+_event_processor_installed = False
 
-def get_sentry_extension() -> Callable[[str], None]:
+
+def get_sentry_extension(event_processor: bool = False) -> Callable[[str], None]:
     """
     Return set_transaction_id, if the Sentry-sdk is installed.
+
+    If `event_processor` is True, install an event processor that tags
+    events with correlation IDs when they are captured instead, and return
+    a no-op, so no Sentry work is done per request or task.
     """
     try:
         import sentry_sdk  # noqa: F401, TC002
 
-        from asgi_correlation_id.extensions.sentry import set_transaction_id
+        from asgi_correlation_id.extensions.sentry import install_event_processor, set_transaction_id
 
+        if event_processor:
+            install_event_processor()
+            return lambda correlation_id: None
         return set_transaction_id
     except ImportError:  # pragma: no cover
         return lambda correlation_id: None
@@ -31,3 +40,37 @@ def set_transaction_id(correlation_id: str) -> None:
     else:
         with sentry_sdk.configure_scope() as scope:
             scope.set_tag('transaction_id', correlation_id)
+
+
+def add_correlation_tags(event: Dict[str, Any], hint: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Tag a Sentry event with the correlation- and Celery tracing IDs of the
+    context it was captured in.
+
+    Tags that are already set on the event are left as is.
+    """
+    from asgi_correlation_id.context import celery_current_id, celery_parent_id, correlation_id
+
+    tags: Dict[str, Any] = event.setdefault('tags', {})
+    for tag, context_var in (
+        ('transaction_id', correlation_id),
+        ('celery_parent_id', celery_parent_id),
+        ('celery_current_id', celery_current_id),
+    ):
+        value = context_var.get()
+        if value is not None:
+            tags.setdefault(tag, value)
+    return event
+
+
+def install_event_processor() -> None:
+    """
+    Install add_correlation_tags as a global Sentry event processor, once.
+    """
+    global _event_processor_installed
+
+    if not _event_processor_installed:
+        from sentry_sdk.scope import add_global_event_processor
+
+        add_global_event_processor(add_correlation_tags)  # type: ignore[arg-type]
+        _event_processor_installed = True
@@ -0,0 +1,68 @@
+import abc
+import os
+import weakref
+from itertools import count
+from typing import Iterator
+
+
+class ForkAwareGenerator(abc.ABC):
+    """
+    Base class for stateful ID generators.
+
+    `reseed` is called on initialization, and again in the child process
+    after every fork, so worker processes forked from the same parent
+    (e.g. by gunicorn, uvicorn or Celery's prefork pool) never share state.
+    """
+
+    def __init__(self) -> None:
+        self.reseed()
+        if hasattr(os, 'register_at_fork'):
+            # Fork hooks can't be unregistered, so don't let them keep the generator alive
+            reseed = weakref.WeakMethod(self.reseed)
+
+            def after_fork_in_child() -> None:
+                method = reseed()
+                if method is not None:
+                    method()
+
+            os.register_at_fork(after_in_child=after_fork_in_child)
+
+    @abc.abstractmethod
+    def reseed(self) -> None: ...
+
+    @abc.abstractmethod
+    def __call__(self) -> str: ...
+
+
+# Bit layout of IDs generated by ProcessIdGenerator, from least significant bit
+_COUNTER_BITS = 40
+_PID_BITS = 22
+_VARIANT = 0b10 << 62
+_VERSION = 4 << 76
+_RANDOM_MASK = ((1 << 128) - 1) ^ ((1 << 64) - 1) ^ (0xF << 76)
+
+
+class ProcessIdGenerator(ForkAwareGenerator):
+    """
+    Generate uuid4-formatted hex IDs from a per-process random prefix,
+    the process ID, and a counter.
+
+    IDs are unique within the process without locking, since the counter
+    is advanced atomically. The process ID makes IDs from sibling processes
+    on the same host distinct, and the random prefix, drawn again after each
+    fork, makes IDs from different hosts and restarts distinct.
+    """
+
+    def reseed(self) -> None:
+        prefix = int.from_bytes(os.urandom(16), 'big') & _RANDOM_MASK
+        pid = (os.getpid() & ((1 << _PID_BITS) - 1)) << _COUNTER_BITS
+        self._base = prefix | _VERSION | _VARIANT | pid
+        self._counter: Iterator[int] = count()
+
+    def __call__(self) -> str:
+        value = next(self._counter)
+        if value >> _COUNTER_BITS:
+            # Counter exhausted - start over with a new prefix
+            self.reseed()
+            value = next(self._counter)
+        return format(self._base | value, '032x')
@@ -1,26 +1,58 @@
+from contextvars import ContextVar
 from logging import Filter
-from typing import TYPE_CHECKING, Optional
-
-from asgi_correlation_id.context import celery_current_id, celery_parent_id, correlation_id
+from typing import TYPE_CHECKING, Dict, Optional
+from weakref import WeakSet
+
+from asgi_correlation_id.codecs import BinaryCodec
+from asgi_correlation_id.context import (
+    asyncio_current_id,
+    asyncio_parent_id,
+    celery_current_id,
+    celery_parent_id,
+    correlation_id,
+)
 
 if TYPE_CHECKING:
     from logging import LogRecord
 
+    from asgi_correlation_id.codecs import StringIdCodec
+
 
 def _trim_string(string: Optional[str], string_length: Optional[int]) -> Optional[str]:
     return string[:string_length] if string_length is not None and string else string
 
 
+def _check_codec(codec: Optional['StringIdCodec']) -> Optional['StringIdCodec']:
+    if isinstance(codec, BinaryCodec):
+        raise ValueError(
+            'Log filters write IDs as text, so they can only be used with string codecs, like base64url_codec'
+        )
+    return codec
+
+
+def _encode_string(string: Optional[str], codec: Optional['StringIdCodec']) -> Optional[str]:
+    return codec.encode(string) if codec is not None and string else string
+
+
 # Middleware
 
 
 class CorrelationIdFilter(Filter):
     """Logging filter to attached correlation IDs to log records"""
 
-    def __init__(self, name: str = '', uuid_length: Optional[int] = None, default_value: Optional[str] = None):
+    def __init__(
+        self,
+        name: str = '',
+        uuid_length: Optional[int] = None,
+        default_value: Optional[str] = None,
+        asyncio_ids: bool = False,
+        codec: Optional['StringIdCodec'] = None,
+    ):
         super().__init__(name=name)
         self.uuid_length = uuid_length
         self.default_value = default_value
+        self.asyncio_ids = asyncio_ids
+        self.codec = _check_codec(codec)
 
     def filter(self, record: 'LogRecord') -> bool:
         """
@@ -30,9 +62,15 @@ class CorrelationIdFilter(Filter):
         log generated from a request after this point can easily be searched
         for, if the correlation ID is added to the message, or included as
         metadata.
+
+        If `asyncio_ids` is enabled, the asyncio current- and parent ID of
+        tasks spawned with child IDs are attached as well.
         """
         cid = correlation_id.get(self.default_value)
-        record.correlation_id = _trim_string(cid, self.uuid_length)
+        record.correlation_id = _trim_string(_encode_string(cid, self.codec), self.uuid_length)
+        if self.asyncio_ids:
+            record.asyncio_parent_id = asyncio_parent_id.get(self.default_value)
+            record.asyncio_current_id = asyncio_current_id.get(self.default_value)
         return True
 
 
@@ -40,10 +78,17 @@ class CorrelationIdFilter(Filter):
 
 
 class CeleryTracingIdsFilter(Filter):
-    def __init__(self, name: str = '', uuid_length: Optional[int] = None, default_value: Optional[str] = None):
+    def __init__(
+        self,
+        name: str = '',
+        uuid_length: Optional[int] = None,
+        default_value: Optional[str] = None,
+        codec: Optional['StringIdCodec'] = None,
+    ):
         super().__init__(name=name)
         self.uuid_length = uuid_length
         self.default_value = default_value
+        self.codec = _check_codec(codec)
 
     def filter(self, record: 'LogRecord') -> bool:
         """
@@ -55,7 +100,83 @@ class CeleryTracingIdsFilter(Filter):
         or from an endpoint, the parent ID will be None.
         """
         pid = celery_parent_id.get(self.default_value)
-        record.celery_parent_id = _trim_string(pid, self.uuid_length)
+        record.celery_parent_id = _trim_string(_encode_string(pid, self.codec), self.uuid_length)
         cid = celery_current_id.get(self.default_value)
-        record.celery_current_id = _trim_string(cid, self.uuid_length)
+        record.celery_current_id = _trim_string(_encode_string(cid, self.codec), self.uuid_length)
+        return True
+
+
+# Pre-rendered ID prefixes
+
+
+_prefix_filters: 'WeakSet[CorrelationIdPrefixFilter]' = WeakSet()
+
+# Companion to the ID context vars, holding the prefix rendered by each filter
+_rendered_prefixes: ContextVar[Optional[Dict['CorrelationIdPrefixFilter', str]]] = ContextVar(
+    'rendered_prefixes', default=None
+)
+
+
+def render_log_prefixes() -> None:
+    """
+    Render the ID prefix of every CorrelationIdPrefixFilter for the current context.
+
+    This is called by the middleware and the Celery extension whenever they
+    set IDs. If you set the ID context vars yourself, call this afterwards.
+    """
+    if not _prefix_filters:
+        return
+    ids = {
+        'correlation_id': correlation_id.get(),
+        'celery_parent_id': celery_parent_id.get(),
+        'celery_current_id': celery_current_id.get(),
+    }
+    _rendered_prefixes.set({filter_: filter_.render(ids) for filter_ in _prefix_filters})
+
+
+class CorrelationIdPrefixFilter(Filter):
+    """
+    Logging filter to attach a pre-rendered prefix of correlation- and
+    Celery tracing IDs to log records.
+
+    The prefix is rendered once, when IDs are set, rather than for every log
+    record. The format can use the `correlation_id`, `celery_parent_id` and
+    `celery_current_id` fields, and the result is attached to records as the
+    `attribute_name` attribute.
+    """
+
+    def __init__(
+        self,
+        name: str = '',
+        fmt: str = '[%(correlation_id)s] [%(celery_parent_id)s-%(celery_current_id)s]',
+        attribute_name: str = 'id_prefix',
+        uuid_length: Optional[int] = None,
+        default_value: Optional[str] = None,
+        codec: Optional['StringIdCodec'] = None,
+    ):
+        super().__init__(name=name)
+        self.fmt = fmt
+        self.attribute_name = attribute_name
+        self.uuid_length = uuid_length
+        self.default_value = default_value
+        self.codec = _check_codec(codec)
+        self.empty_prefix = self.render({})
+        _prefix_filters.add(self)
+
+    def render(self, ids: Dict[str, Optional[str]]) -> str:
+        return self.fmt % {
+            key: (
+                self.default_value
+                if ids.get(key) is None
+                else _trim_string(_encode_string(ids[key], self.codec), self.uuid_length)
+            )
+            for key in ('correlation_id', 'celery_parent_id', 'celery_current_id')
+        }
+
+    def filter(self, record: 'LogRecord') -> bool:
+        """
+        Attach the ID prefix rendered for the current context to the log record.
+        """
+        prefixes = _rendered_prefixes.get()
+        setattr(record, self.attribute_name, prefixes.get(self, self.empty_prefix) if prefixes else self.empty_prefix)
         return True
@@ -0,0 +1,302 @@
+"""
+Offline correlation of JSON logs written with the package's log filters.
+
+Log files are read line by line through mmap, and the position of every
+line with a correlation ID is stored in an SQLite index. Request timelines
+and Celery task trees are then rebuilt from the index, reading only the
+lines they need, so memory use does not grow with the size of the logs.
+
+Usage:
+
+    asgi-correlation-logs index logs.db api.log worker-*.log --processes 4
+    asgi-correlation-logs timeline logs.db <correlation-id>
+    asgi-correlation-logs tree logs.db <correlation-id>
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import sys
+from contextlib import ExitStack, closing
+from multiprocessing import Pool
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.request import pathname2url
+
+TIME_FIELDS = ('timestamp', '@timestamp', 'time', 'asctime', 'created')
+
+# Values written by the log filters when an ID is not set
+MISSING_VALUES = frozenset(('', '-', 'None'))
+
+BATCH_SIZE = 10_000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lines (
+    correlation_id TEXT NOT NULL,
+    timestamp TEXT,
+    file_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    celery_parent_id TEXT,
+    celery_current_id TEXT
+);
+'''
+
+INDEXES = '''
+CREATE INDEX IF NOT EXISTS lines_correlation_id ON lines (correlation_id, timestamp, file_id, offset);
+'''
+
+# Used to delete the lines of files that are indexed again
+FILE_INDEX = '''
+CREATE INDEX IF NOT EXISTS lines_file_id ON lines (file_id);
+'''
+
+Row = Tuple[str, Optional[str], int, int, int, Optional[str], Optional[str]]
+
+
+def _connect(index_path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(index_path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _connect_read_only(index_path: str) -> sqlite3.Connection:
+    # Don't let a mistyped path create an empty index
+    if not os.path.isfile(index_path):
+        raise FileNotFoundError(f'No such index: {index_path}')
+    return sqlite3.connect(f'file:{pathname2url(os.path.abspath(index_path))}?mode=ro', uri=True)
+
+
+def iter_lines(path: str) -> Iterator[Tuple[int, bytes]]:
+    """
+    Yield the offset and content of each line in a file.
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            offset = 0
+            for line in iter(mapped.readline, b''):
+                yield offset, line
+                offset += len(line)
+
+
+def _get_id(record: Dict[str, Any], key: str) -> Optional[str]:
+    value = record.get(key)
+    if value is None or str(value) in MISSING_VALUES:
+        return None
+    return str(value)
+
+
+def _get_timestamp(record: Dict[str, Any]) -> Optional[str]:
+    for field in TIME_FIELDS:
+        if record.get(field) is not None:
+            return str(record[field])
+    return None
+
+
+def iter_rows(path: str, file_id: int) -> Iterator[Row]:
+    """
+    Yield index rows for the lines of a file that have a correlation ID.
+    """
+    for offset, line in iter_lines(path):
+        # Skip the JSON parsing of lines that can't match
+        if b'correlation_id' not in line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict):
+            continue
+        cid = _get_id(record, 'correlation_id')
+        if cid is None:
+            continue
+        yield (
+            cid,
+            _get_timestamp(record),
+            file_id,
+            offset,
+            len(line),
+            _get_id(record, 'celery_parent_id'),
+            _get_id(record, 'celery_current_id'),
+        )
+
+
+def _insert_rows(connection: sqlite3.Connection, rows: Iterator[Row]) -> int:
+    count = 0
+    batch: List[Row] = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            connection.executemany('INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+            count += len(batch)
+            batch = []
+    connection.executemany('INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+    return count + len(batch)
+
+
+def _index_file_to(args: Tuple[str, int, str]) -> str:
+    """
+    Index a single file into a separate index, for merging by the main process.
+    """
+    path, file_id, part_path = args
+    # Don't append to a part left behind by a run that crashed
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    connection = _connect(part_path)
+    with connection:
+        _insert_rows(connection, iter_rows(path, file_id))
+    connection.close()
+    return part_path
+
+
+def build_index(index_path: str, paths: Sequence[str], processes: int = 1) -> None:
+    """
+    Index the log lines of the given files by correlation ID.
+
+    With more than one process, files are indexed in parallel, each into a
+    separate temporary index, which is merged into the main index afterwards.
+    Files that are already in the index are indexed again, replacing their
+    lines one file at a time, so a file that fails to index leaves the lines
+    of the other files in place.
+    """
+    for path in paths:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f'No such log file: {path}')
+
+    connection = _connect(index_path)
+    file_ids = []
+    with connection:
+        connection.execute(FILE_INDEX)
+        for path in paths:
+            path = os.path.abspath(path)
+            connection.execute('INSERT OR IGNORE INTO files (path) VALUES (?)', (path,))
+            (file_id,) = connection.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+            file_ids.append((path, file_id))
+
+    if processes > 1 and len(file_ids) > 1:
+        jobs = [(path, file_id, f'{index_path}.part{file_id}') for path, file_id in file_ids]
+        part_ids = {part_path: file_id for _, file_id, part_path in jobs}
+        with Pool(min(processes, len(jobs))) as pool:
+            for part_path in pool.imap_unordered(_index_file_to, jobs):
+                connection.execute('ATTACH DATABASE ? AS part', (part_path,))
+                with connection:
+                    connection.execute('DELETE FROM lines WHERE file_id = ?', (part_ids[part_path],))
+                    connection.execute('INSERT INTO lines SELECT * FROM part.lines')
+                connection.execute('DETACH DATABASE part')
+                os.remove(part_path)
+    else:
+        for path, file_id in file_ids:
+            with connection:
+                connection.execute('DELETE FROM lines WHERE file_id = ?', (file_id,))
+                _insert_rows(connection, iter_rows(path, file_id))
+
+    with connection:
+        connection.executescript(INDEXES)
+    connection.close()
+
+
+def timeline(index_path: str, correlation_id: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the log records of a correlation ID, ordered by time.
+
+    Records without a timestamp come first, ordered by file and by their
+    position in the file.
+    """
+    with closing(_connect_read_only(index_path)) as connection, ExitStack() as stack:
+        paths = dict(connection.execute('SELECT id, path FROM files'))
+        rows = connection.execute(
+            'SELECT file_id, offset, length FROM lines WHERE correlation_id = ? ORDER BY timestamp, file_id, offset',
+            (correlation_id,),
+        )
+        files: Dict[int, BinaryIO] = {}
+        for file_id, offset, length in rows:
+            if file_id not in files:
+                # Closed by the exit stack
+                files[file_id] = stack.enter_context(open(paths[file_id], 'rb'))  # noqa: SIM115
+            file = files[file_id]
+            file.seek(offset)
+            yield json.loads(file.read(length))
+
+
+def task_tree(index_path: str, correlation_id: str) -> Dict[Optional[str], List[str]]:
+    """
+    Return the Celery tasks of a correlation ID, as a mapping of parent ID to child IDs.
+
+    Tasks without a parent, or with a parent that didn't log anything, are
+    listed under None.
+    """
+    with closing(_connect_read_only(index_path)) as connection:
+        rows = connection.execute(
+            'SELECT celery_current_id, celery_parent_id, MIN(timestamp), MIN(file_id), MIN(offset) FROM lines'
+            ' WHERE correlation_id = ? AND celery_current_id IS NOT NULL'
+            ' GROUP BY celery_current_id ORDER BY 3, 4, 5',
+            (correlation_id,),
+        ).fetchall()
+
+    task_ids = {current_id for current_id, *_ in rows}
+    tree: Dict[Optional[str], List[str]] = {}
+    for current_id, parent_id, *_ in rows:
+        tree.setdefault(parent_id if parent_id in task_ids else None, []).append(current_id)
+    return tree
+
+
+def _write_tree(tree: Dict[Optional[str], List[str]]) -> None:
+    # Walk the tree with an explicit stack, since Celery chains can be deeper
+    # than the recursion limit. Tasks that aren't reachable from a root, e.g.
+    # because trimmed IDs collided into a cycle, are written as roots, once.
+    roots = [*tree.get(None, []), *(task_id for children in tree.values() for task_id in children)]
+    visited = set()
+    for root in roots:
+        stack = [(root, 0)]
+        while stack:
+            task_id, depth = stack.pop()
+            if task_id in visited:
+                continue
+            visited.add(task_id)
+            sys.stdout.write(f'{"    " * depth}{task_id}\n')
+            stack.extend((child_id, depth + 1) for child_id in reversed(tree.get(task_id, [])))
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='asgi-correlation-logs', description='Correlate JSON logs by correlation ID and Celery tracing IDs.'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    index_parser = subparsers.add_parser('index', help='Index log files by correlation ID')
+    index_parser.add_argument('index', help='Path of the index file')
+    index_parser.add_argument('files', nargs='+', help='JSON log files to index')
+    index_parser.add_argument('--processes', type=int, default=1, help='Number of files to index in parallel')
+
+    timeline_parser = subparsers.add_parser('timeline', help='Print the log records of a correlation ID')
+    timeline_parser.add_argument('index', help='Path of the index file')
+    timeline_parser.add_argument('correlation_id')
+
+    tree_parser = subparsers.add_parser('tree', help='Print the Celery task tree of a correlation ID')
+    tree_parser.add_argument('index', help='Path of the index file')
+    tree_parser.add_argument('correlation_id')
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'index':
+            build_index(args.index, args.files, processes=args.processes)
+        elif args.command == 'timeline':
+            for record in timeline(args.index, args.correlation_id):
+                sys.stdout.write(json.dumps(record) + '\n')
+        else:
+            _write_tree(task_tree(args.index, args.correlation_id))
+    except (OSError, sqlite3.Error) as error:
+        sys.stderr.write(f'{parser.prog}: error: {error}\n')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -1,16 +1,20 @@
 import logging
 from dataclasses import dataclass, field
-from typing import TYPE_CHECKING, Callable, Optional
+from typing import TYPE_CHECKING, Callable, List, Literal, Optional, Sequence, Tuple
 from uuid import UUID, uuid4
 
 from starlette.datastructures import MutableHeaders
 
 from asgi_correlation_id.context import correlation_id
 from asgi_correlation_id.extensions.sentry import get_sentry_extension
+from asgi_correlation_id.log_filters import render_log_prefixes
+from asgi_correlation_id.trusted_networks import TrustedNetworks
 
 if TYPE_CHECKING:
     from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+    from asgi_correlation_id.codecs import IdCodec
+
 logger = logging.getLogger('asgi_correlation_id')
 
 
@@ -26,6 +30,10 @@ def is_valid_uuid4(uuid_: str) -> bool:
 
 FAILED_VALIDATION_MESSAGE = 'Generated new request ID (%s), since request header value failed validation'
 
+RESPONSE_HEADER_POLICIES = ('append', 'replace', 'skip_if_present')
+
+EXPOSE_HEADERS = b'access-control-expose-headers'
+
 
 @dataclass
 class CorrelationIdMiddleware:
@@ -42,6 +50,21 @@ class CorrelationIdMiddleware:
     # ID transformer - can be used to clean/mutate IDs
     transformer: Optional[Callable[[str], str]] = field(default=lambda a: a)
 
+    # How to handle a response header with the same name, set by the app
+    response_header_policy: Literal['append', 'replace', 'skip_if_present'] = 'append'
+
+    # Whether to add the header name to the Access-Control-Expose-Headers response header
+    expose_header: bool = False
+
+    # ID codec - can be used to send and receive IDs in a compact form
+    header_codec: Optional['IdCodec'] = None
+
+    # Networks (in CIDR notation) of upstream proxies whose request IDs are used as is
+    trusted_networks: Optional[Sequence[str]] = None
+
+    # Whether to tag Sentry events when they are captured, rather than tagging the scope of every request
+    sentry_event_processor: bool = False
+
     async def __call__(self, scope: 'Scope', receive: 'Receive', send: 'Send') -> None:
         """
         Load request ID from headers if present. Generate one otherwise.
@@ -52,12 +75,22 @@ class CorrelationIdMiddleware:
 
         # Try to load request ID from the request headers
         headers = MutableHeaders(scope=scope)
-        header_value = headers.get(self.header_name.lower())
+        raw_header_value = headers.get(self.header_name.lower())
+
+        # Convert compact IDs back to their canonical form, before validation
+        header_value = raw_header_value
+        if header_value and self.header_codec:
+            header_value = self.header_codec.decode(header_value)
 
         validation_failed = False
+        trusted = False
         if not header_value:
             # Generate request ID if none was found
             id_value = self.generator()
+        elif self.is_trusted(scope):
+            # Skip validation and transformation of request IDs from trusted upstream proxies
+            trusted = True
+            id_value = header_value
         elif self.validator and not self.validator(header_value):
             # Also generate a request ID if one was found, but it was deemed invalid
             validation_failed = True
@@ -67,42 +100,113 @@ class CorrelationIdMiddleware:
             id_value = header_value
 
         # Clean/change the ID if needed
-        if self.transformer:
+        if self.transformer and not trusted:
             id_value = self.transformer(id_value)
 
         if validation_failed is True:
             logger.warning(FAILED_VALIDATION_MESSAGE, id_value)
 
         # Update the request headers if needed
-        if id_value != header_value and self.update_request_header is True:
+        if id_value != raw_header_value and self.update_request_header is True:
             headers[self.header_name] = id_value
 
         correlation_id.set(id_value)
+        render_log_prefixes()
         self.sentry_extension(id_value)
 
         async def handle_outgoing_request(message: 'Message') -> None:
-            if message['type'] == 'http.response.start' and correlation_id.get():
-                headers = MutableHeaders(scope=message)
-                headers.append(self.header_name, correlation_id.get())
+            if message['type'] == 'http.response.start':
+                id_value = correlation_id.get()
+                if id_value:
+                    self.set_response_headers(message, id_value)
 
             await send(message)
 
         await self.app(scope, receive, handle_outgoing_request)
         return
 
+    def is_trusted(self, scope: 'Scope') -> bool:
+        """
+        Check whether the request was sent by a trusted upstream proxy.
+        """
+        if self._trusted_networks is None:
+            return False
+        client = scope.get('client')
+        return client is not None and client[0] in self._trusted_networks
+
+    def set_response_headers(self, message: 'Message', id_value: str) -> None:
+        """
+        Add the request ID to the response headers, according to the response header policy.
+
+        The response headers are scanned once, for existing request ID
+        and Access-Control-Expose-Headers headers.
+        """
+        headers: List[Tuple[bytes, bytes]] = list(message.get('headers', ()))
+        message['headers'] = headers
+        if self.header_codec:
+            id_value = self.header_codec.encode(id_value)
+        encoded_value = id_value.encode('latin-1')
+
+        if self.response_header_policy == 'append' and not self.expose_header:
+            # Nothing to look for
+            headers.append((self._encoded_header_name, encoded_value))
+            return
+
+        existing = []
+        expose_index = None
+        for index, (key, _) in enumerate(headers):
+            key = key.lower()
+            if key == self._encoded_header_name:
+                existing.append(index)
+            elif key == EXPOSE_HEADERS:
+                expose_index = index
+
+        if self.expose_header:
+            if expose_index is None:
+                headers.append((EXPOSE_HEADERS, self._encoded_expose_value))
+            else:
+                exposed = headers[expose_index][1]
+                names = [name.strip().lower() for name in exposed.split(b',')]
+                if b'*' not in names and self._encoded_header_name not in names:
+                    headers[expose_index] = (EXPOSE_HEADERS, exposed + b', ' + self._encoded_expose_value)
+
+        if existing and self.response_header_policy == 'skip_if_present':
+            return
+        if self.response_header_policy == 'replace':
+            for index in reversed(existing):
+                del headers[index]
+        headers.append((self._encoded_header_name, encoded_value))
+
     def __post_init__(self) -> None:
         """
         Load extensions on initialization.
 
         If Sentry is installed, propagate correlation IDs to Sentry events.
-        If Celery is installed, propagate correlation IDs to spawned worker processes.
+        If Celery is installed, propagate correlation IDs to spawned worker processes,
+        unless the Celery hooks have already been loaded, e.g., by another middleware
+        instance or by a manual call to `load_correlation_ids`. In that case, the
+        loaded hooks are only switched to the Sentry event processor, if requested.
         """
-        self.sentry_extension = get_sentry_extension()
+        if self.response_header_policy not in RESPONSE_HEADER_POLICIES:
+            raise ValueError(
+                f'Invalid response_header_policy {self.response_header_policy!r},'
+                f' expected one of {RESPONSE_HEADER_POLICIES}'
+            )
+        self._encoded_header_name = self.header_name.lower().encode('latin-1')
+        self._encoded_expose_value = self.header_name.encode('latin-1')
+        self._trusted_networks = TrustedNetworks(self.trusted_networks) if self.trusted_networks else None
+
+        self.sentry_extension = get_sentry_extension(event_processor=self.sentry_event_processor)
         try:
             import celery  # noqa: F401, TC002
 
-            from asgi_correlation_id.extensions.celery import load_correlation_ids
+            from asgi_correlation_id.extensions.celery import CORRELATION_ID_HOOKS, hook_settings, load_correlation_ids
 
-            load_correlation_ids()
+            settings = hook_settings(CORRELATION_ID_HOOKS)
+            if settings is None:
+                load_correlation_ids(sentry_event_processor=self.sentry_event_processor)
+            elif self.sentry_event_processor and not settings.get('sentry_event_processor'):
+                # Switch the loaded hooks to the event processor, keeping their other settings
+                load_correlation_ids(**{**settings, 'sentry_event_processor': True})
         except ImportError:  # pragma: no cover
             pass
@@ -0,0 +1,84 @@
+import asyncio
+import sys
+from contextvars import copy_context
+from itertools import count
+from typing import TYPE_CHECKING, Any, Callable, Coroutine, Optional, TypeVar
+
+from asgi_correlation_id.context import asyncio_current_id, asyncio_parent_id
+
+if TYPE_CHECKING:
+    from contextvars import Context
+
+T = TypeVar('T')
+
+_task_counter = count(1)
+
+
+def counter_hex_generator() -> str:
+    """
+    Return the next value of a process-wide counter, as hex.
+
+    This is much cheaper than generating a uuid, and is unique within
+    the process, which is enough to tell concurrent tasks apart in the
+    logs of a single request.
+    """
+    return format(next(_task_counter), 'x')
+
+
+def _set_child_ids(generator: Callable[[], str]) -> None:
+    asyncio_parent_id.set(asyncio_current_id.get())
+    asyncio_current_id.set(generator())
+
+
+def _child_context(generator: Callable[[], str], context: Optional['Context'] = None) -> 'Context':
+    """
+    Return a copy of the given (or current) context, with child IDs set.
+    """
+    context = context.copy() if context is not None else copy_context()
+    context.run(_set_child_ids, generator)
+    return context
+
+
+def spawn_with_child_id(
+    coro: Coroutine[Any, Any, T],
+    name: Optional[str] = None,
+    generator: Callable[[], str] = counter_hex_generator,
+) -> 'asyncio.Task[T]':
+    """
+    Schedule a coroutine as a task with its own asyncio ID.
+
+    The task inherits the correlation ID like any other task, while the
+    current asyncio ID becomes its parent ID.
+    """
+    loop = asyncio.get_running_loop()
+    context = _child_context(generator)
+    # Tasks accept an explicit context from Python 3.11. Before that, they
+    # copy the context they are created in.
+    if sys.version_info >= (3, 11):
+        return loop.create_task(coro, name=name, context=context)
+    return context.run(loop.create_task, coro, name=name)
+
+
+def install_child_id_task_factory(
+    loop: Optional[asyncio.AbstractEventLoop] = None,
+    generator: Callable[[], str] = counter_hex_generator,
+) -> None:
+    """
+    Give every task created on the loop its own asyncio ID.
+
+    This covers tasks created by `asyncio.gather`, `asyncio.TaskGroup`,
+    `loop.create_task` and friends. A previously installed task factory
+    is still used to create the tasks.
+    """
+    loop = loop or asyncio.get_running_loop()
+    previous_factory: Optional[Callable[..., 'asyncio.Future[Any]']] = loop.get_task_factory()
+
+    def task_factory(loop: asyncio.AbstractEventLoop, coro: Any, **kwargs: Any) -> 'asyncio.Future[Any]':
+        context = _child_context(generator, kwargs.pop('context', None))
+        if previous_factory is not None:
+            return context.run(previous_factory, loop, coro, **kwargs)
+        if sys.version_info >= (3, 11):
+            return asyncio.Task(coro, loop=loop, context=context, **kwargs)
+        return context.run(asyncio.Task, coro, loop=loop, **kwargs)  # type: ignore[arg-type]
+
+    loop.set_task_factory(task_factory)
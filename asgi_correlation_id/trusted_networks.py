@@ -0,0 +1,45 @@
+from functools import lru_cache
+from ipaddress import IPv6Address, ip_address, ip_network
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+
+
+class TrustedNetworks:
+    """
+    Fast membership test for a set of IP networks.
+
+    Networks are grouped by prefix length, so a lookup costs one set lookup
+    per distinct prefix length, rather than one comparison per network.
+    Results are cached per host, since requests tend to come from a small
+    number of upstream proxies.
+    """
+
+    def __init__(self, networks: Iterable[str], cache_size: int = 1024):
+        grouped: Dict[int, Dict[int, Set[int]]] = {4: {}, 6: {}}
+        for network in networks:
+            parsed = ip_network(network, strict=False)
+            prefixes = grouped[parsed.version].setdefault(parsed.prefixlen, set())
+            prefixes.add(int(parsed.network_address) >> (parsed.max_prefixlen - parsed.prefixlen))
+
+        self._prefixes: Dict[int, List[Tuple[int, FrozenSet[int]]]] = {
+            version: [(prefixlen, frozenset(values)) for prefixlen, values in sorted(by_length.items())]
+            for version, by_length in grouped.items()
+        }
+        self.contains = lru_cache(maxsize=cache_size)(self._contains)
+
+    def _contains(self, host: str) -> bool:
+        try:
+            address = ip_address(host)
+        except ValueError:
+            # E.g. unix sockets, or test clients
+            return False
+        if isinstance(address, IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+
+        value = int(address)
+        return any(
+            value >> (address.max_prefixlen - prefixlen) in prefixes
+            for prefixlen, prefixes in self._prefixes[address.version]
+        )
+
+    def __contains__(self, host: str) -> bool:
+        return self.contains(host)
@@ -0,0 +1,53 @@
+from uuid import uuid4
+
+import pytest
+
+from asgi_correlation_id.codecs import base64url_codec, binary_codec
+
+
+def test_base64url_codec():
+    id_value = uuid4().hex
+    encoded = base64url_codec.encode(id_value)
+    assert len(encoded) == 23
+    assert encoded.startswith('~')
+    assert '=' not in encoded
+    assert base64url_codec.decode(encoded) == id_value
+
+
+def test_binary_codec():
+    id_value = uuid4().hex
+    encoded = binary_codec.encode(id_value)
+    assert encoded == bytes.fromhex(id_value)
+    assert binary_codec.decode(encoded) == id_value
+
+
+@pytest.mark.parametrize('codec', [base64url_codec, binary_codec])
+@pytest.mark.parametrize(
+    'value',
+    [
+        'test',
+        str(uuid4()),
+        'x' * 32,
+        # 22-character IDs from custom generators, made of base64url characters
+        'Hs8KZm3Pq2vTnW4xYbRc9L',
+        base64url_codec.encode(uuid4().hex)[1:],
+        # Marked values that encode would never produce
+        '~Hs8KZm3Pq2vTnW4xYbRc9L',
+        '~' + 'x' * 21 + '!',
+    ],
+)
+def test_codecs_pass_other_values_through(codec, value):
+    """
+    We expect values that aren't canonical IDs, or compact IDs, to be left as is.
+    """
+    assert codec.encode(value) == value
+    assert codec.decode(value) == value
+
+
+@pytest.mark.parametrize('codec', [base64url_codec, binary_codec])
+def test_codecs_decode_canonical_ids(codec):
+    """
+    We expect canonical IDs to be accepted from peers that don't use a codec.
+    """
+    id_value = uuid4().hex
+    assert codec.decode(id_value) == id_value
@@ -1,11 +1,29 @@
 import logging
+import time
 import warnings
 from uuid import UUID, uuid4
 
 import pytest
 from celery import shared_task
-
-from asgi_correlation_id.extensions.celery import load_celery_current_and_parent_ids, load_correlation_ids
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from fastapi import FastAPI
+
+from asgi_correlation_id.codecs import base64url_codec
+from asgi_correlation_id.context import correlation_id
+from asgi_correlation_id.extensions.celery import (
+    CELERY_METRICS_HOOKS,
+    CORRELATION_ID_HOOKS,
+    CeleryTaskMetrics,
+    Histogram,
+    hook_settings,
+    hooks_registered,
+    load_celery_current_and_parent_ids,
+    load_celery_task_metrics,
+    load_correlation_ids,
+    unload_celery_task_metrics,
+    unload_correlation_ids,
+)
+from asgi_correlation_id.middleware import CorrelationIdMiddleware
 from tests.conftest import default_app
 
 logger = logging.getLogger('asgi_correlation_id')
@@ -34,6 +52,12 @@ def task3():
     logger.info('test3')
 
 
+@shared_task(bind=True, max_retries=3)
+def retried_task(self):
+    if self.request.retries < 3:
+        raise self.retry(countdown=0)
+
+
 async def test_endpoint_to_worker_to_worker(client, caplog, celery_session_app, celery_session_worker):
     """
     We expect:
@@ -103,3 +127,267 @@ async def test_worker_to_worker_to_worker(caplog, celery_session_app, celery_ses
         assert record.celery_parent_id == last_current_id
 
         last_current_id = record.celery_current_id
+
+
+def _receiver_counts():
+    return [len(signal.receivers) for signal in (before_task_publish, task_prerun, task_postrun)]
+
+
+def test_hooks_are_not_duplicated_across_middleware_instances():
+    """
+    We expect the number of connected receivers, and with it the per-task
+    cost of each signal, to stay constant however many apps are built.
+    """
+    counts = _receiver_counts()
+
+    for _ in range(1000):
+        CorrelationIdMiddleware(FastAPI())
+
+    assert _receiver_counts() == counts
+
+
+def test_hooks_are_not_duplicated_when_loaded_repeatedly():
+    counts = _receiver_counts()
+
+    for _ in range(1000):
+        load_correlation_ids()
+        load_celery_current_and_parent_ids()
+
+    assert _receiver_counts() == counts
+
+
+def test_unload_and_reconfigure_hooks():
+    """
+    We expect unloading to disconnect the receivers, and loading with a
+    different configuration to replace the previous receivers.
+    """
+    counts = _receiver_counts()
+
+    unload_correlation_ids()
+    assert not hooks_registered(CORRELATION_ID_HOOKS)
+    assert _receiver_counts() == [count - 1 for count in counts]
+
+    load_correlation_ids(header_key='OTHER_CORRELATION_ID')
+    cid = uuid4().hex
+    token = correlation_id.set(cid)
+    headers = {}
+    before_task_publish.send(sender='task', headers=headers)
+    correlation_id.reset(token)
+    assert headers == {'OTHER_CORRELATION_ID': cid}
+    assert _receiver_counts() == counts
+
+    load_correlation_ids()
+    assert _receiver_counts() == counts
+
+
+async def test_codec(caplog, celery_session_app, celery_session_worker):
+    """
+    We expect IDs to be sent to workers in compact form, and to be
+    converted back to their canonical form by the worker.
+    """
+    load_correlation_ids(codec=base64url_codec)
+    load_celery_current_and_parent_ids(codec=base64url_codec)
+    caplog.set_level('DEBUG')
+    try:
+        cid = uuid4().hex
+        token = correlation_id.set(cid)
+        headers = {}
+        before_task_publish.send(sender='task', headers=headers)
+        task1.delay().get(timeout=10)
+        correlation_id.reset(token)
+    finally:
+        load_correlation_ids()
+        load_celery_current_and_parent_ids()
+
+    assert headers == {'CORRELATION_ID': base64url_codec.encode(cid)}
+    assert [record.correlation_id for record in caplog.records] == [cid] * 3
+    assert caplog.records[1].celery_parent_id == caplog.records[0].celery_current_id
+
+
+def test_codec_passes_custom_ids_through():
+    """
+    We expect IDs from custom generators to reach the worker unchanged,
+    even when they look like base64url.
+    """
+    from types import SimpleNamespace
+
+    load_correlation_ids(codec=base64url_codec)
+    try:
+        custom_id = 'Hs8KZm3Pq2vTnW4xYbRc9L'
+        token = correlation_id.set(custom_id)
+        headers = {}
+        before_task_publish.send(sender='task', headers=headers)
+        correlation_id.reset(token)
+
+        task = SimpleNamespace(request=headers)
+        task_prerun.send(sender=None, task_id='task-id', task=task)
+        assert correlation_id.get() == custom_id
+        task_postrun.send(sender=None, task_id='task-id', task=task)
+    finally:
+        load_correlation_ids()
+
+    assert headers['CORRELATION_ID'] == custom_id
+
+
+def wait_for_postrun(metrics, name, timeout=10):
+    """
+    Results are stored before task_postrun is sent, so wait for it to be recorded.
+    """
+    deadline = time.monotonic() + timeout
+    while not metrics.snapshot()[name]['count'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+async def test_task_metrics_retries(celery_session_app, celery_session_worker):
+    """
+    We expect retries to be recorded once per task, and execution time once per attempt.
+    """
+    metrics = load_celery_task_metrics()
+    try:
+        retried_task.delay().get(timeout=10)
+        wait_for_postrun(metrics, 'retries')
+    finally:
+        unload_celery_task_metrics()
+
+    snapshot = metrics.snapshot()
+    assert snapshot['retries']['count'] == 1
+    assert snapshot['retries']['sum'] == 3
+    assert snapshot['execution_seconds']['count'] == 4
+    assert snapshot['queue_wait_seconds']['count'] == 4
+
+
+def test_task_metrics_exemplar_from_headers():
+    """
+    We expect the exemplar to be read from the task headers, whatever the
+    order in which the prerun receivers run.
+    """
+    from types import SimpleNamespace
+
+    metrics = load_celery_task_metrics(codec=base64url_codec)
+    try:
+        cid = uuid4().hex
+        task = SimpleNamespace(request={'CORRELATION_ID': base64url_codec.encode(cid), 'CELERY_PUBLISHED_AT': 0})
+        token = correlation_id.set('other')
+        task_prerun.send(sender=None, task_id='task-id', task=task)
+        task_postrun.send(sender=None, task_id='task-id', task=task)
+        correlation_id.reset(token)
+    finally:
+        unload_celery_task_metrics()
+
+    buckets = metrics.snapshot()['queue_wait_seconds']['buckets']
+    assert [exemplar for _, count, exemplar in buckets if count] == [cid]
+
+
+def test_task_metrics_export_is_atomic():
+    exported = []
+    metrics = CeleryTaskMetrics(exporter=exported.append, export_interval=0)
+    metrics.retries.observe(1)
+    metrics.maybe_export()
+    metrics.retries.observe(2)
+    metrics.export()
+
+    assert [snapshot['retries']['sum'] for snapshot in exported] == [1, 2]
+    assert metrics.retries.pop()['count'] == 0
+
+
+def test_log_prefix_rendered():
+    """
+    We expect log prefixes to be rendered on prerun, and cleared on postrun.
+    """
+    from types import SimpleNamespace
+
+    from asgi_correlation_id import CorrelationIdPrefixFilter
+
+    filter_ = CorrelationIdPrefixFilter(fmt='%(correlation_id)s %(celery_current_id)s', default_value='-')
+    record = logging.LogRecord('', logging.INFO, '', 0, '', (), None)
+    cid = uuid4().hex
+    task = SimpleNamespace(request={'CORRELATION_ID': cid})
+
+    task_prerun.send(sender=None, task_id='task-id', task=task)
+    filter_.filter(record)
+    assert record.id_prefix.startswith(f'{cid} ')
+    assert not record.id_prefix.endswith(' -')
+
+    task_postrun.send(sender=None, task_id='task-id', task=task)
+    filter_.filter(record)
+    assert record.id_prefix == '- -'
+
+
+def test_reconfiguring_hooks_keeps_receiver_order():
+    """
+    We expect a group of hooks to keep its position among a signal's
+    receivers when it's loaded again.
+    """
+    load_celery_task_metrics()
+    try:
+        order = [key for key, _ in task_prerun.receivers]
+        load_correlation_ids(header_key='OTHER_CORRELATION_ID')
+        load_correlation_ids()
+        assert [key for key, _ in task_prerun.receivers] == order
+    finally:
+        unload_celery_task_metrics()
+    assert not hooks_registered(CELERY_METRICS_HOOKS)
+
+
+def test_middleware_switches_hooks_to_sentry_event_processor(mocker):
+    """
+    We expect a middleware asking for the Sentry event processor to switch
+    already loaded hooks to it, keeping their other settings.
+    """
+    mocker.patch('asgi_correlation_id.extensions.sentry.install_event_processor')
+    load_correlation_ids(header_key='OTHER_CORRELATION_ID')
+    try:
+        CorrelationIdMiddleware(FastAPI())
+        assert hook_settings(CORRELATION_ID_HOOKS)['sentry_event_processor'] is False
+
+        CorrelationIdMiddleware(FastAPI(), sentry_event_processor=True)
+        settings = hook_settings(CORRELATION_ID_HOOKS)
+        assert settings['sentry_event_processor'] is True
+        assert settings['header_key'] == 'OTHER_CORRELATION_ID'
+    finally:
+        load_correlation_ids()
+
+
+def test_histogram():
+    histogram = Histogram([1, 0.1])
+    histogram.observe(0.05, 'a')
+    histogram.observe(0.5, 'b')
+    histogram.observe(0.7, 'c')
+    histogram.observe(5)
+
+    assert histogram.snapshot() == {
+        'buckets': [(0.1, 1, 'a'), (1, 2, 'c'), (float('inf'), 1, None)],
+        'count': 4,
+        'sum': 6.25,
+    }
+
+    histogram.reset()
+    assert histogram.snapshot()['count'] == 0
+
+
+async def test_task_metrics(celery_session_app, celery_session_worker):
+    """
+    We expect queue wait time, execution time and retries to be recorded
+    for each task, with the correlation ID kept as an exemplar.
+    """
+    exported = []
+    metrics = load_celery_task_metrics(exporter=exported.append, export_interval=3600)
+    try:
+        cid = uuid4().hex
+        token = correlation_id.set(cid)
+        task3.delay().get(timeout=10)
+        correlation_id.reset(token)
+        wait_for_postrun(metrics, 'retries')
+    finally:
+        unload_celery_task_metrics()
+
+    snapshot = metrics.snapshot()
+    for name in ('queue_wait_seconds', 'execution_seconds', 'retries'):
+        assert snapshot[name]['count'] == 1
+        assert [exemplar for _, count, exemplar in snapshot[name]['buckets'] if count] == [cid]
+    assert snapshot['retries']['sum'] == 0
+    assert exported == []
+
+    metrics.export()
+    assert exported == [snapshot]
+    assert metrics.snapshot()['execution_seconds']['count'] == 0
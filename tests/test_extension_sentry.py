@@ -3,7 +3,9 @@ from unittest.mock import Mock
 import sentry_sdk
 from packaging import version
 
-from asgi_correlation_id.extensions.sentry import set_transaction_id
+from asgi_correlation_id.context import celery_current_id, celery_parent_id, correlation_id
+from asgi_correlation_id.extensions import sentry
+from asgi_correlation_id.extensions.sentry import add_correlation_tags, get_sentry_extension, set_transaction_id
 
 id_value = 'test'
 
@@ -34,3 +36,37 @@ def test_sentry_sdk_installed(mocker):
         mocker.patch.object(sentry_sdk, 'configure_scope', return_value=MockedScope())
         set_transaction_id(id_value)
         set_tag_mock.assert_called_once_with('transaction_id', id_value)
+
+
+def test_add_correlation_tags():
+    """
+    Check that events are tagged with the IDs of the context they are captured in.
+    """
+    event = add_correlation_tags({}, {})
+    assert 'transaction_id' not in event['tags']
+
+    values = [(correlation_id, 'a'), (celery_parent_id, 'b'), (celery_current_id, 'c')]
+    tokens = [(var, var.set(value)) for var, value in values]
+    event = add_correlation_tags({'tags': {'celery_current_id': 'existing'}}, {})
+    for var, token in tokens:
+        var.reset(token)
+
+    assert event['tags'] == {'transaction_id': 'a', 'celery_parent_id': 'b', 'celery_current_id': 'existing'}
+
+
+def test_event_processor_installed_once(mocker):
+    """
+    Check that the event processor is only installed once, and that no
+    per-request tagging is done when it's used.
+    """
+    add_mock = mocker.patch('sentry_sdk.scope.add_global_event_processor')
+    mocker.patch.object(sentry, '_event_processor_installed', False)
+    set_tag_mock = mocker.patch.object(sentry_sdk, 'get_isolation_scope')
+
+    for _ in range(3):
+        extension = get_sentry_extension(event_processor=True)
+        extension(id_value)
+
+    add_mock.assert_called_once_with(add_correlation_tags)
+    set_tag_mock.assert_not_called()
+    assert get_sentry_extension() is set_transaction_id
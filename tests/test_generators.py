@@ -0,0 +1,52 @@
+import os
+from uuid import UUID
+
+import pytest
+
+from asgi_correlation_id.generators import ForkAwareGenerator, ProcessIdGenerator
+from asgi_correlation_id.middleware import is_valid_uuid4
+
+
+def test_process_id_generator():
+    generator = ProcessIdGenerator()
+    ids = [generator() for _ in range(10000)]
+
+    assert len(set(ids)) == len(ids)
+    assert all(is_valid_uuid4(id_) for id_ in ids)
+    assert UUID(ids[0]).variant == UUID(int=0, version=4).variant
+
+
+def test_process_id_generators_are_independent():
+    assert ProcessIdGenerator()() != ProcessIdGenerator()()
+
+
+def test_reseed_is_required():
+    with pytest.raises(TypeError):
+        ForkAwareGenerator()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Requires os.fork')
+def test_process_id_generator_after_fork():
+    """
+    We expect forked processes to produce IDs that differ from
+    the parent's, although they start from the same state.
+    """
+    generator = ProcessIdGenerator()
+    generator()
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # pragma: no cover
+        os.close(read_fd)
+        os.write(write_fd, ' '.join(generator() for _ in range(100)).encode())
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        child_ids = pipe.read().split()
+    os.waitpid(pid, 0)
+    parent_ids = [generator() for _ in range(100)]
+
+    assert len(child_ids) == 100
+    assert not set(child_ids) & set(parent_ids)
+    assert all(is_valid_uuid4(id_) for id_ in child_ids)
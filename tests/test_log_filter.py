@@ -4,8 +4,16 @@ from uuid import uuid4
 
 import pytest
 
-from asgi_correlation_id import CeleryTracingIdsFilter, CorrelationIdFilter
-from asgi_correlation_id.context import celery_current_id, celery_parent_id, correlation_id
+from asgi_correlation_id import CeleryTracingIdsFilter, CorrelationIdFilter, CorrelationIdPrefixFilter
+from asgi_correlation_id.codecs import base64url_codec, binary_codec
+from asgi_correlation_id.context import (
+    asyncio_current_id,
+    asyncio_parent_id,
+    celery_current_id,
+    celery_parent_id,
+    correlation_id,
+)
+from asgi_correlation_id.log_filters import render_log_prefixes
 
 # Initialize context variables to obtain reset tokens which we can later use
 # when testing application of filter default values.
@@ -68,6 +76,35 @@ def test_filter_uses_default_value(cid: str, log_record: LogRecord):
     assert log_record.correlation_id == '-'
 
 
+def test_filter_encodes_correlation_id(cid: str, log_record: LogRecord):
+    filter_ = CorrelationIdFilter(codec=base64url_codec)
+
+    filter_.filter(log_record)
+    assert log_record.correlation_id == base64url_codec.encode(cid)
+
+
+def test_filter_adds_asyncio_ids(cid: str, log_record: LogRecord):
+    filter_ = CorrelationIdFilter(asyncio_ids=True, default_value='-')
+    asyncio_parent_id_token = asyncio_parent_id.set('a')
+    asyncio_current_id_token = asyncio_current_id.set('b')
+
+    filter_.filter(log_record)
+    assert log_record.correlation_id == cid
+    assert log_record.asyncio_parent_id == 'a'
+    assert log_record.asyncio_current_id == 'b'
+
+    asyncio_parent_id.reset(asyncio_parent_id_token)
+    asyncio_current_id.reset(asyncio_current_id_token)
+    filter_.filter(log_record)
+    assert log_record.asyncio_parent_id == '-'
+    assert log_record.asyncio_current_id == '-'
+
+
+def test_filter_skips_asyncio_ids_by_default(cid: str, log_record: LogRecord):
+    CorrelationIdFilter().filter(log_record)
+    assert not hasattr(log_record, 'asyncio_current_id')
+
+
 def test_celery_filter_has_uuid_length_attributes():
     filter_ = CeleryTracingIdsFilter(uuid_length=8)
     assert filter_.uuid_length == 8
@@ -96,6 +133,17 @@ def test_celery_filter_adds_current_id(cid: str, log_record: LogRecord):
     assert log_record.celery_current_id == 'b'
 
 
+def test_celery_filter_encodes_ids(cid: str, log_record: LogRecord):
+    filter_ = CeleryTracingIdsFilter(codec=base64url_codec, uuid_length=8)
+    parent_id, current_id = uuid4().hex, uuid4().hex
+    celery_parent_id.set(parent_id)
+    celery_current_id.set(current_id)
+
+    filter_.filter(log_record)
+    assert log_record.celery_parent_id == base64url_codec.encode(parent_id)[:8]
+    assert log_record.celery_current_id == base64url_codec.encode(current_id)[:8]
+
+
 def test_celery_filter_uses_default_value(cid: str, log_record: LogRecord):
     """
     We expect the filter to set the log record attributes to the default value
@@ -160,3 +208,51 @@ def test_celery_filter_maintains_current_behavior(cid: str, log_record: LogRecor
     original_filter_record_id = log_record.celery_current_id
 
     assert original_filter_record_id == new_filter_record_id
+
+
+def test_prefix_filter_renders_prefix_once(cid: str, log_record: LogRecord):
+    """
+    We expect the prefix to be rendered when IDs are set, not per log record.
+    """
+    filter_ = CorrelationIdPrefixFilter(uuid_length=8, default_value='-')
+    celery_parent_id.set(None)
+    celery_current_id.set('b' * 32)
+    render_log_prefixes()
+
+    filter_.filter(log_record)
+    assert log_record.id_prefix == f'[{cid[:8]}] [--bbbbbbbb]'
+
+    # Changes to the context vars are picked up on the next render
+    correlation_id.set('a' * 32)
+    filter_.filter(log_record)
+    assert log_record.id_prefix == f'[{cid[:8]}] [--bbbbbbbb]'
+    render_log_prefixes()
+    filter_.filter(log_record)
+    assert log_record.id_prefix == '[aaaaaaaa] [--bbbbbbbb]'
+
+
+def test_prefix_filter_options(cid: str, log_record: LogRecord):
+    filter_ = CorrelationIdPrefixFilter(fmt='cid=%(correlation_id)s', attribute_name='ids', codec=base64url_codec)
+    render_log_prefixes()
+
+    filter_.filter(log_record)
+    assert log_record.ids == f'cid={base64url_codec.encode(cid)}'
+
+
+def test_prefix_filter_without_rendered_prefix(log_record: LogRecord):
+    """
+    We expect IDs to be rendered as the default value, before any prefix was rendered.
+    """
+    filter_ = CorrelationIdPrefixFilter(default_value='-')
+
+    contextvars.Context().run(filter_.filter, log_record)
+    assert log_record.id_prefix == '[-] [---]'
+
+
+@pytest.mark.parametrize('filter_class', [CorrelationIdFilter, CeleryTracingIdsFilter, CorrelationIdPrefixFilter])
+def test_filters_reject_binary_codec(filter_class):
+    """
+    We expect log filters to refuse codecs that don't encode IDs as strings.
+    """
+    with pytest.raises(ValueError, match='string codecs'):
+        filter_class(codec=binary_codec)
@@ -0,0 +1,209 @@
+import json
+import sqlite3
+
+import pytest
+
+from asgi_correlation_id import log_index
+from asgi_correlation_id.log_index import build_index, main, task_tree, timeline
+
+CID = 'a' * 32
+
+
+@pytest.fixture
+def log_files(tmp_path):
+    """Write an API log and a Celery worker log for two requests"""
+    api_log = tmp_path / 'api.log'
+    worker_log = tmp_path / 'worker.log'
+    api_records = [
+        {'timestamp': '2024-01-01 00:00:00', 'correlation_id': CID, 'message': 'request'},
+        {'timestamp': '2024-01-01 00:00:01', 'correlation_id': 'b' * 32, 'message': 'other request'},
+        {'timestamp': '2024-01-01 00:00:02', 'correlation_id': '-', 'message': 'startup'},
+    ]
+    worker_records = [
+        {
+            'timestamp': f'2024-01-01 00:00:0{second}',
+            'correlation_id': CID,
+            'celery_parent_id': parent,
+            'celery_current_id': current,
+        }
+        for second, parent, current in [(3, '-', 't1'), (4, 't1', 't2'), (5, 't1', 't3'), (6, 't2', 't4')]
+    ]
+    api_log.write_text('\n'.join(json.dumps(record) for record in api_records) + '\nnot json correlation_id\n')
+    worker_log.write_text(''.join(json.dumps(record) + '\n' for record in worker_records))
+    (tmp_path / 'empty.log').write_text('')
+    return [str(api_log), str(worker_log), str(tmp_path / 'empty.log')], api_records, worker_records
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_timeline(tmp_path, log_files, processes):
+    """
+    We expect the records of a correlation ID to be returned in order, across files.
+    """
+    paths, api_records, worker_records = log_files
+    index = str(tmp_path / 'index.db')
+    build_index(index, paths, processes=processes)
+
+    assert list(timeline(index, CID)) == [api_records[0], *worker_records]
+    assert list(timeline(index, '-')) == []
+
+
+def test_reindex(tmp_path, log_files):
+    paths, api_records, worker_records = log_files
+    index = str(tmp_path / 'index.db')
+    build_index(index, paths)
+    build_index(index, paths[:1])
+
+    assert len(list(timeline(index, CID))) == 1 + len(worker_records)
+
+
+def test_reindex_missing_file(tmp_path, log_files):
+    """
+    We expect the index to be left untouched when a log file is missing.
+    """
+    paths, api_records, worker_records = log_files
+    index = str(tmp_path / 'index.db')
+    build_index(index, paths)
+    (tmp_path / 'api.log').rename(tmp_path / 'api.log.1')
+
+    with pytest.raises(FileNotFoundError):
+        build_index(index, paths)
+    (tmp_path / 'api.log.1').rename(tmp_path / 'api.log')
+    assert len(list(timeline(index, CID))) == 1 + len(worker_records)
+
+
+def test_reindex_failure_keeps_other_files(tmp_path, log_files, monkeypatch):
+    """
+    We expect a file that fails to index to keep its previous lines, and not to affect other files.
+    """
+    paths, api_records, worker_records = log_files
+    index = str(tmp_path / 'index.db')
+    build_index(index, paths)
+    iter_rows = log_index.iter_rows
+
+    def failing_iter_rows(path, file_id):
+        yield from iter_rows(path, file_id)
+        if path.endswith('worker.log'):
+            raise OSError('Read error')
+
+    monkeypatch.setattr(log_index, 'iter_rows', failing_iter_rows)
+    with pytest.raises(OSError, match='Read error'):
+        build_index(index, paths)
+    assert list(timeline(index, CID)) == [api_records[0], *worker_records]
+
+
+def test_task_tree(tmp_path, log_files):
+    paths, *_ = log_files
+    index = str(tmp_path / 'index.db')
+    build_index(index, paths)
+
+    assert task_tree(index, CID) == {None: ['t1'], 't1': ['t2', 't3'], 't2': ['t4']}
+
+
+def test_cli(tmp_path, log_files, capsys):
+    paths, api_records, _ = log_files
+    index = str(tmp_path / 'index.db')
+
+    assert main(['index', index, *paths]) == 0
+    assert main(['timeline', index, CID]) == 0
+    assert capsys.readouterr().out.splitlines()[0] == json.dumps(api_records[0])
+
+    assert main(['tree', index, CID]) == 0
+    assert capsys.readouterr().out.splitlines() == ['t1', '    t2', '        t4', '    t3']
+
+
+def test_cli_deep_task_tree(tmp_path, capsys):
+    """
+    We expect task chains deeper than the recursion limit to be written.
+    """
+    log = tmp_path / 'worker.log'
+    task_ids = [f't{number}' for number in range(1500)]
+    records = [
+        {'correlation_id': CID, 'celery_parent_id': parent_id, 'celery_current_id': current_id}
+        for parent_id, current_id in zip(['-', *task_ids], task_ids)
+    ]
+    log.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    index = str(tmp_path / 'index.db')
+    build_index(index, [str(log)])
+
+    assert main(['tree', index, CID]) == 0
+    assert capsys.readouterr().out.splitlines() == [f'{"    " * depth}t{depth}' for depth in range(1500)]
+
+
+def test_cli_task_tree_cycle(tmp_path, capsys):
+    """
+    We expect tasks whose trimmed IDs collide into a cycle to be written once.
+    """
+    log = tmp_path / 'worker.log'
+    records = [
+        {'correlation_id': CID, 'celery_parent_id': parent_id, 'celery_current_id': current_id}
+        for parent_id, current_id in [('t2', 't1'), ('t1', 't2'), ('t3', 't3')]
+    ]
+    log.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    index = str(tmp_path / 'index.db')
+    build_index(index, [str(log)])
+
+    assert main(['tree', index, CID]) == 0
+    assert capsys.readouterr().out.splitlines() == ['t1', '    t2', 't3']
+
+
+def test_cli_missing_file(tmp_path, capsys):
+    missing = str(tmp_path / 'missing.log')
+
+    assert main(['index', str(tmp_path / 'index.db'), missing]) == 1
+    assert capsys.readouterr().err == f'asgi-correlation-logs: error: No such log file: {missing}\n'
+
+
+def test_leftover_part_files_are_replaced(tmp_path, log_files):
+    """
+    We expect parts left behind by a crashed run not to add duplicate rows.
+    """
+    paths, api_records, worker_records = log_files
+    index = str(tmp_path / 'index.db')
+    build_index(index, paths, processes=2)
+    for file_id in (1, 2, 3):
+        build_index(str(tmp_path / 'other.db'), [paths[file_id - 1]])
+        (tmp_path / 'other.db').rename(tmp_path / f'index.db.part{file_id}')
+
+    build_index(index, paths, processes=2)
+    assert len(list(timeline(index, CID))) == 1 + len(worker_records)
+
+
+def test_timeline_without_timestamps(tmp_path):
+    """
+    We expect records without a timestamp to come first, in file order.
+    """
+    log = tmp_path / 'log'
+    records = [
+        {'timestamp': '2024-01-01 00:00:00', 'correlation_id': CID, 'message': '1'},
+        {'correlation_id': CID, 'message': '2'},
+        {'correlation_id': CID, 'message': '3'},
+    ]
+    log.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    index = str(tmp_path / 'index.db')
+    build_index(index, [str(log)])
+
+    assert [record['message'] for record in timeline(index, CID)] == ['2', '3', '1']
+
+
+@pytest.mark.parametrize('command', ['timeline', 'tree'])
+def test_cli_missing_index(tmp_path, capsys, command):
+    """
+    We expect queries not to create an index at a mistyped path.
+    """
+    index = tmp_path / 'missing.db'
+
+    assert main([command, str(index), CID]) == 1
+    assert capsys.readouterr().err == f'asgi-correlation-logs: error: No such index: {index}\n'
+    assert not index.exists()
+
+
+def test_queries_are_read_only(tmp_path, log_files):
+    paths, *_ = log_files
+    index = str(tmp_path / 'index.db')
+    build_index(index, paths)
+    connection = sqlite3.connect(index)
+    connection.execute('DROP TABLE lines')
+    connection.close()
+
+    with pytest.raises(sqlite3.OperationalError, match='no such table'):
+        task_tree(index, CID)
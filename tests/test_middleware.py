@@ -3,11 +3,13 @@ from typing import TYPE_CHECKING
 from uuid import uuid4
 
 import pytest
-from fastapi import Request, Response
-from httpx import AsyncClient
+from fastapi import FastAPI, Request, Response
+from httpx import ASGITransport, AsyncClient
+from starlette.middleware import Middleware
 from starlette.testclient import TestClient
 
-from asgi_correlation_id.middleware import FAILED_VALIDATION_MESSAGE, is_valid_uuid4
+from asgi_correlation_id.codecs import base64url_codec
+from asgi_correlation_id.middleware import FAILED_VALIDATION_MESSAGE, CorrelationIdMiddleware, is_valid_uuid4
 from tests.conftest import (
     TRANSFORMER_VALUE,
     default_app,
@@ -178,3 +180,144 @@ def test_is_valid_uuid4():
     assert is_valid_uuid4('foo') is False
     assert is_valid_uuid4('9e6454c4-21d5-4e4a-a66a-b28f15576414-1') is False
     assert is_valid_uuid4('00000000000000000000000000000000') is False
+
+
+def build_app(**kwargs):
+    app = FastAPI(middleware=[Middleware(CorrelationIdMiddleware, **kwargs)])
+
+    @app.get('/existing-header')
+    async def existing_header_view() -> Response:
+        return Response(headers={'X-Request-ID': 'existing', 'Access-Control-Expose-Headers': 'X-Other'})
+
+    return app
+
+
+@pytest.mark.parametrize(
+    ('policy', 'expected'),
+    [
+        ('append', ['existing', 'new']),
+        ('replace', ['new']),
+        ('skip_if_present', ['existing']),
+    ],
+)
+async def test_response_header_policy(policy, expected):
+    """
+    We expect the response header policy to decide what happens to
+    request ID headers set by the app.
+    """
+    cid = uuid4().hex
+    async with AsyncClient(app=build_app(response_header_policy=policy), base_url='http://test') as client:
+        response = await client.get('existing-header', headers={'X-Request-ID': cid})
+        assert response.headers.get_list('X-Request-ID') == [cid if value == 'new' else value for value in expected]
+
+        # Without a header set by the app, the ID is always added
+        response = await client.get('test', headers={'X-Request-ID': cid})
+        assert response.headers.get_list('X-Request-ID') == [cid]
+
+
+def test_invalid_response_header_policy():
+    with pytest.raises(ValueError, match='Invalid response_header_policy'):
+        CorrelationIdMiddleware(FastAPI(), response_header_policy='prepend')
+
+
+async def test_expose_header():
+    """
+    We expect the header name to be added to Access-Control-Expose-Headers,
+    whether or not the app set the header.
+    """
+    async with AsyncClient(app=build_app(expose_header=True), base_url='http://test') as client:
+        response = await client.get('existing-header')
+        assert response.headers.get_list('Access-Control-Expose-Headers') == ['X-Other, X-Request-ID']
+
+        response = await client.get('test')
+        assert response.headers.get_list('Access-Control-Expose-Headers') == ['X-Request-ID']
+
+    async with AsyncClient(app=default_app, base_url='http://test') as client:
+        response = await client.get('test')
+        assert 'Access-Control-Expose-Headers' not in response.headers
+
+
+async def test_header_codec():
+    """
+    We expect compact IDs to be decoded before validation, to be canonical
+    within the app, and to be encoded again in the response.
+    """
+    app = FastAPI(middleware=[Middleware(CorrelationIdMiddleware, header_codec=base64url_codec)])
+
+    @app.get('/test')
+    async def test_view(request: Request) -> dict:
+        return {'correlation_id': request.headers.get('X-Request-ID')}
+
+    cid = uuid4().hex
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        response = await client.get('test', headers={'X-Request-ID': base64url_codec.encode(cid)})
+        assert response.json()['correlation_id'] == cid
+        assert response.headers['X-Request-ID'] == base64url_codec.encode(cid)
+
+        # Canonical IDs are accepted too
+        response = await client.get('test', headers={'X-Request-ID': cid})
+        assert response.headers['X-Request-ID'] == base64url_codec.encode(cid)
+
+
+async def test_header_codec_passes_custom_ids_through():
+    """
+    We expect IDs from custom generators to be left as is, even when
+    they look like base64url.
+    """
+    app = FastAPI(middleware=[Middleware(CorrelationIdMiddleware, header_codec=base64url_codec, validator=None)])
+
+    @app.get('/test')
+    async def test_view(request: Request) -> dict:
+        return {'correlation_id': request.headers.get('X-Request-ID')}
+
+    custom_id = 'Hs8KZm3Pq2vTnW4xYbRc9L'
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        response = await client.get('test', headers={'X-Request-ID': custom_id})
+        assert response.json()['correlation_id'] == custom_id
+        assert response.headers['X-Request-ID'] == custom_id
+
+
+@pytest.mark.parametrize(('client', 'trusted'), [(('10.0.0.1', 123), True), (('8.8.8.8', 123), False)])
+async def test_trusted_networks(caplog, client, trusted):
+    """
+    We expect request IDs from trusted upstream proxies to skip validation and
+    transformation, and request IDs from other clients to be checked as usual.
+    """
+    app = FastAPI(
+        middleware=[Middleware(CorrelationIdMiddleware, trusted_networks=['10.0.0.0/8'], transformer=str.upper)]
+    )
+    transport = ASGITransport(app=app, client=client)
+    async with AsyncClient(transport=transport, base_url='http://test') as client:
+        response = await client.get('test', headers={'X-Request-ID': 'edge-id'})
+        if trusted:
+            assert response.headers['X-Request-ID'] == 'edge-id'
+            assert caplog.messages == []
+        else:
+            assert response.headers['X-Request-ID'] != 'edge-id'
+            assert response.headers['X-Request-ID'].isupper()
+            assert caplog.messages[0] == FAILED_VALIDATION_MESSAGE.replace('%s', response.headers['X-Request-ID'])
+
+        # IDs are still generated and transformed when no header is sent
+        response = await client.get('test')
+        assert response.headers['X-Request-ID'].isupper()
+
+
+async def test_log_prefix_rendered():
+    """
+    We expect the middleware to render log prefixes when setting the correlation ID.
+    """
+    from asgi_correlation_id import CorrelationIdPrefixFilter
+
+    filter_ = CorrelationIdPrefixFilter(fmt='%(correlation_id)s')
+    app = FastAPI(middleware=[Middleware(CorrelationIdMiddleware)])
+
+    @app.get('/test')
+    async def test_view() -> dict:
+        record = logging.LogRecord('', logging.INFO, '', 0, '', (), None)
+        filter_.filter(record)
+        return {'prefix': record.id_prefix}
+
+    cid = uuid4().hex
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        response = await client.get('test', headers={'X-Request-ID': cid})
+        assert response.json()['prefix'] == cid
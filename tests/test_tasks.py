@@ -0,0 +1,55 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+from asgi_correlation_id.context import asyncio_current_id, asyncio_parent_id, correlation_id
+from asgi_correlation_id.tasks import install_child_id_task_factory, spawn_with_child_id
+
+pytestmark = pytest.mark.asyncio
+
+
+async def get_ids():
+    return correlation_id.get(), asyncio_parent_id.get(), asyncio_current_id.get()
+
+
+async def test_spawn_with_child_id():
+    """
+    We expect each spawned task to get its own current ID, with the
+    spawning task's current ID as parent ID, and to keep the correlation ID.
+    """
+    cid = uuid4().hex
+    correlation_id.set(cid)
+
+    first, second = await asyncio.gather(spawn_with_child_id(get_ids()), spawn_with_child_id(get_ids()))
+    assert first[:2] == second[:2] == (cid, None)
+    assert first[2] is not None
+    assert second[2] is not None
+    assert first[2] != second[2]
+
+    async def spawn_grandchild():
+        return asyncio_current_id.get(), await spawn_with_child_id(get_ids())
+
+    child_id, (grandchild_cid, grandchild_parent_id, grandchild_id) = await spawn_with_child_id(spawn_grandchild())
+    assert grandchild_cid == cid
+    assert grandchild_parent_id == child_id
+    assert grandchild_id not in (child_id, None)
+
+    # The spawning context is left untouched
+    assert asyncio_current_id.get() is None
+
+
+async def test_child_id_task_factory():
+    """
+    We expect every task created on the loop to get its own current ID.
+    """
+    loop = asyncio.get_running_loop()
+    previous_factory = loop.get_task_factory()
+    install_child_id_task_factory(loop, generator=iter(['a', 'b', 'c']).__next__)
+    try:
+        results = await asyncio.gather(get_ids(), get_ids(), loop.create_task(get_ids(), name='named'))
+    finally:
+        loop.set_task_factory(previous_factory)
+
+    assert sorted(current for _, _, current in results) == ['a', 'b', 'c']
+    assert all(parent is None for _, parent, _ in results)
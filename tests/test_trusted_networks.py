@@ -0,0 +1,29 @@
+import pytest
+
+from asgi_correlation_id.trusted_networks import TrustedNetworks
+
+trusted_networks = TrustedNetworks(['10.0.0.0/8', '192.168.1.0/24', '172.16.0.1', 'fd00::/8'])
+
+
+@pytest.mark.parametrize(
+    ('host', 'expected'),
+    [
+        ('10.1.2.3', True),
+        ('192.168.1.255', True),
+        ('192.168.2.1', False),
+        ('172.16.0.1', True),
+        ('172.16.0.2', False),
+        ('fd12::1', True),
+        ('fe80::1', False),
+        ('::ffff:10.0.0.1', True),
+        ('8.8.8.8', False),
+        ('testclient', False),
+        ('/tmp/uvicorn.sock', False),
+    ],
+)
+def test_trusted_networks(host, expected):
+    assert (host in trusted_networks) is expected
+
+
+def test_empty_trusted_networks():
+    assert '10.0.0.1' not in TrustedNetworks([])